@@ -1,7 +1,9 @@
 ### --- main.py --- ###
 
 import os
-from fastapi import FastAPI, BackgroundTasks, HTTPException
+import time
+import asyncio
+from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
@@ -10,6 +12,9 @@ load_dotenv()
 
 # Import your main agent function
 from solver.agent import run_quiz_solver_background
+from solver.http import open_client, close_client
+from solver.tools import close_browser
+from solver.planner import load_encoding
 
 app = FastAPI(
     title="LLM Analysis Quiz Agent",
@@ -19,11 +24,30 @@ app = FastAPI(
 # Load required variables
 MY_SECRET = os.environ.get("MY_SECRET")
 MY_EMAIL = os.environ.get("MY_EMAIL")
+# How many quiz runs may be solving at the same time. Extra ones wait for a slot.
+MAX_CONCURRENT_QUIZZES = int(os.environ.get("MAX_CONCURRENT_QUIZZES", "5"))
 
 if not MY_SECRET or not MY_EMAIL:
     print("FATAL ERROR: MY_SECRET or MY_EMAIL not found in environment.")
     # In a real app, you'd exit, but FastAPI will just fail to start
     #
+
+# --- Lifespan: one shared HTTP client (and browser) for the whole app ---
+@app.on_event("startup")
+async def startup():
+    open_client()
+    app.state.quiz_slots = asyncio.Semaphore(MAX_CONCURRENT_QUIZZES)
+    app.state.quiz_tasks = set()
+    await load_encoding()
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Stop any quiz runs still in flight before closing what they use
+    for task in app.state.quiz_tasks:
+        task.cancel()
+    await asyncio.gather(*app.state.quiz_tasks, return_exceptions=True)
+    await close_browser()
+    await close_client()
     
 # --- Pydantic Models ---
 class QuizPayload(BaseModel):
@@ -39,12 +63,33 @@ class APIResponse(BaseModel):
     message: str
 
 
+# --- Quiz job runner ---
+async def run_quiz_job(email: str, secret: str, url: str, start_time: float):
+    """
+    Runs one quiz solve once a concurrency slot is free.
+    `start_time` is when the request was accepted, so time spent queued
+    still counts against the quiz's time limit.
+    """
+    async with app.state.quiz_slots:
+        await run_quiz_solver_background(email, secret, url, start_time=start_time)
+
+def submit_quiz_job(email: str, secret: str, url: str):
+    """
+    Starts the solver as its own asyncio task, so it isn't tied to the request.
+    We keep a reference to each task until it's done (asyncio only holds weak refs).
+    """
+    task = asyncio.create_task(run_quiz_job(email, secret, url, time.time()))
+    app.state.quiz_tasks.add(task)
+    task.add_done_callback(app.state.quiz_tasks.discard)
+    return task
+
+
 # --- API Endpoint ---
 @app.post("/quiz-endpoint", response_model=APIResponse)
-async def start_quiz(payload: QuizPayload, background_tasks: BackgroundTasks):
+async def start_quiz(payload: QuizPayload):
     """
     Receives the initial quiz task, validates it, and starts
-    the solver in a background task.
+    the solver as a background job.
     """
     
     # 1. Validate Secret
@@ -63,10 +108,9 @@ async def start_quiz(payload: QuizPayload, background_tasks: BackgroundTasks):
             detail="Invalid email provided."
         )
 
-    # 3. Add the *actual* work as a background task
+    # 3. Queue the *actual* work as a background job
     print(f"Task accepted for {payload.email}, URL: {payload.url}")
-    background_tasks.add_task(
-        run_quiz_solver_background,
+    submit_quiz_job(
         payload.email,
         payload.secret,
         payload.url
@@ -80,4 +124,9 @@ async def start_quiz(payload: QuizPayload, background_tasks: BackgroundTasks):
 
 @app.get("/")
 async def root():
-    return {"message": "LLM Quiz Agent is running. POST to /quiz-endpoint to start."}
\ No newline at end of file
+    return {"message": "LLM Quiz Agent is running. POST to /quiz-endpoint to start."}
+
+if __name__ == "__main__":
+    import uvicorn
+    # uvloop + httptools: the C event loop and HTTP parser (both come with uvicorn[standard])
+    uvicorn.run("main:app", host="0.0.0.0", port=int(os.environ.get("PORT", "8000")), loop="uvloop", http="httptools")
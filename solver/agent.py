@@ -1,8 +1,11 @@
-import httpx
 import os
+import re
 import time
-from urllib.parse import urljoin  # <-- This is the fix for relative URLs
-from .planner import get_plan_from_llm, get_answer_from_llm
+import asyncio
+from urllib.parse import urljoin, urlparse  # <-- This is the fix for relative URLs
+from .http import get_client, phase_timeout, run_phase
+from .planner import get_plan_from_llm, get_answer_from_llm, csv_context_for_llm, load_encoding
+from .local_solvers import solve_csv_locally, solve_secret_code_locally
 from .tools import (
     scrape_page_content, 
     download_file, 
@@ -15,64 +18,152 @@ from .tools import (
 MY_EMAIL = os.environ.get("MY_EMAIL")
 MY_SECRET = os.environ.get("MY_SECRET")
 
-async def run_quiz_solver_background(email: str, secret: str, initial_url: str):
+# Overall budget for one quiz run, and the most any single phase of a turn may take
+TIME_LIMIT = 170 # 170 seconds, just under 3 mins
+SCRAPE_BUDGET = 30.0
+PLAN_BUDGET = 40.0 # Covers retries and the gpt-4o fallback
+DOWNLOAD_BUDGET = 30.0
+ANSWER_BUDGET = 30.0
+SUBMIT_BUDGET = 15.0
+
+DATA_FILE_EXTENSIONS = (".csv", ".pdf", ".mp3", ".wav")
+
+# Same rule the planner follows: a literal <a href> ending in a data-file extension.
+DATA_LINK_RE = re.compile(r'href="([^"]+\.(?:csv|pdf|mp3|wav))"', re.IGNORECASE)
+
+def _discard_prefetch(task: asyncio.Task):
+    """
+    Drops a speculative download we turned out not to need.
+    """
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled():
+        task.exception()  # Mark any error as retrieved, we don't care about it
+
+async def _evict_turn(page_context, question, data_context, current_url):
+    """
+    Drops a failed turn's plan and answer from the LLM cache,
+    so a retry or rerun asks the LLM again instead of replaying them.
+    """
+    if page_context is not None:
+        await get_plan_from_llm.evict(page_context)
+    if question is not None and data_context is not None:
+        await get_answer_from_llm.evict(question, data_context, context_url=current_url)
+
+async def run_quiz_solver_background(email: str, secret: str, initial_url: str, start_time: float | None = None):
     """
     The main, recursive-style function that solves the quiz.
+    `start_time` is when the quiz was received (defaults to now); the time limit counts from it.
     """
     
     current_url = initial_url
-    start_time = time.time()
+    if start_time is None:
+        start_time = time.time()
+    deadline = start_time + TIME_LIMIT
+    last_submit_url = None
+    last_question = None
     
     # The quiz loop
     while current_url:
         # Check for 3-minute timeout
-        if (time.time() - start_time) > 170: # 170 seconds, just under 3 mins
+        if time.time() > deadline:
             print("Nearing 3-minute timeout. Stopping task.")
             break
             
         print(f"\n--- New Task ---")
         print(f"Processing URL: {current_url}")
         
+        # Filled in as the turn goes, so a failed turn can be evicted from the cache
+        page_context = question = data_context = None
         try:
-            # 1. Scrape the page
-            page_context = await scrape_page_content(current_url)
-            if page_context.startswith("Error:"):
-                print(f"Failed to scrape: {page_context}")
-                break
+            path = urlparse(current_url).path.lower()
+            if path.endswith(DATA_FILE_EXTENSIONS):
+                # The URL *is* the data file: nothing to scrape or plan, just download it.
+                print("URL points straight to a data file, skipping scrape and planner.")
+                page_context = f"Data file URL: {current_url}"
+                prefetch_task = None
+                # No page to read the task from: it's the same task applied to a new file,
+                # so carry over the previous turn's question (e.g. "CSV file\nCutoff: N").
+                question = last_question or f"Answer the task for the data file at {current_url}"
+                data_url = current_url
+                submit_url = last_submit_url or urljoin(current_url, "/submit")
+            else:
+                # 1. Scrape the page
+                try:
+                    page_context = await run_phase(
+                        scrape_page_content(current_url), deadline, SCRAPE_BUDGET
+                    )
+                except asyncio.TimeoutError:
+                    page_context = "Error: Scraping the page timed out."
+                if page_context.startswith("Error:"):
+                    print(f"Failed to scrape: {page_context}")
+                    break
             
-            # 2. Get a plan from the LLM
-            plan = await get_plan_from_llm(page_context)
-            if "error" in plan:
-                print(f"Failed to get plan: {plan['error']}")
-                break
+                # 2. Get a plan from the LLM
+                # While the planner runs, speculatively download the data file if the
+                # HTML already has an obvious link to one. Discarded if the planner disagrees.
+                prefetch_url = None
+                prefetch_task = None
+                data_links = DATA_LINK_RE.findall(page_context)
+                if data_links:
+                    prefetch_url = urljoin(current_url, data_links[0])
+                    prefetch_task = asyncio.create_task(download_file(prefetch_url, "temp_data"))
+
+                try:
+                    plan = await run_phase(
+                        get_plan_from_llm(page_context, timeout=phase_timeout(deadline, PLAN_BUDGET)),
+                        deadline, PLAN_BUDGET
+                    )
+                except asyncio.TimeoutError:
+                    plan = {"error": "Planner timed out."}
+                if "error" in plan:
+                    print(f"Failed to get plan: {plan['error']}")
+                    if prefetch_task:
+                        _discard_prefetch(prefetch_task)
+                    break
             
-            print(f"Plan received: {plan.get('question')}")
+                print(f"Plan received: {plan.get('question')}")
             
-            question = plan.get("question")
-            data_url = plan.get("data_url")
-            submit_url = plan.get("submit_url")
+                question = plan.get("question")
+                data_url = plan.get("data_url")
+                submit_url = plan.get("submit_url")
 
-            # --- FIX #1: This joins the base URL (current_url) with any relative paths ---
-            if data_url:
-                data_url = urljoin(current_url, data_url)
-            if submit_url:
-                submit_url = urljoin(current_url, submit_url)
+                # --- FIX #1: This joins the base URL (current_url) with any relative paths ---
+                if data_url:
+                    data_url = urljoin(current_url, data_url)
+                if submit_url:
+                    submit_url = urljoin(current_url, submit_url)
+
+            last_submit_url = submit_url
+            last_question = question
             
             # --- FIX #2: This passes the page text to the Answerer ---
             # By default, the context IS the page we just scraped.
             data_context = page_context 
+            csv_df = None
+            
+            # Only keep the prefetched file if the planner picked the same URL
+            if prefetch_task and data_url != prefetch_url:
+                _discard_prefetch(prefetch_task)
+                prefetch_task = None
             
             # 3. Execute the plan (Get Data)
             # If we find a file, THEN we overwrite the context.
             if data_url:
-                print(f"Data URL found, downloading: {data_url}") 
                 try:
-                    file_path = await download_file(data_url, "temp_data")
+                    if prefetch_task:
+                        print(f"Data URL found, using prefetched download: {data_url}")
+                        file_path = await run_phase(prefetch_task, deadline, DOWNLOAD_BUDGET)
+                    else:
+                        print(f"Data URL found, downloading: {data_url}") 
+                        file_path = await run_phase(
+                            download_file(data_url, "temp_data"), deadline, DOWNLOAD_BUDGET
+                        )
                     
                     if file_path.endswith('.pdf'):
                         data_context = get_text_from_pdf(file_path)
                     elif file_path.endswith('.csv'):
-                        data_context = get_text_from_csv(file_path)
+                        csv_df, data_context = get_text_from_csv(file_path)
                     else:
                         # Fallback for audio or unknown files
                         # We can't read them as text, so we'll just pass the path
@@ -84,10 +175,40 @@ async def run_quiz_solver_background(email: str, secret: str, initial_url: str):
                     data_context = f"Error processing file: {e}" 
             
             # 4. Get the answer
-            final_answer = await get_answer_from_llm(question, data_context)
+            # Try to solve it locally first (secret code, CSV cutoff sum), only then ask the LLM.
+            final_answer = solve_secret_code_locally(question, data_context)
+            if final_answer is not None:
+                print("Found secret code locally, skipping the LLM.")
+            elif csv_df is not None:
+                final_answer = solve_csv_locally(question, csv_df)
+                if final_answer is not None:
+                    print("Solved CSV task locally, skipping the LLM.")
+                else:
+                    # The LLM has to do the math itself, so it needs every row, not the preview
+                    # (sorted, so truncating a big file only drops the smallest values)
+                    await load_encoding()
+                    data_context = await asyncio.to_thread(csv_context_for_llm, csv_df)
+            if final_answer is None:
+                try:
+                    final_answer = await run_phase(
+                        get_answer_from_llm(
+                            question, data_context,
+                            context_url=current_url,
+                            timeout=phase_timeout(deadline, ANSWER_BUDGET)
+                        ),
+                        deadline, ANSWER_BUDGET
+                    )
+                except asyncio.TimeoutError:
+                    final_answer = "Error: Answerer timed out."
             print(f"Final answer computed: {str(final_answer)[:50]}...")
             
             # 5. Submit the answer
+            # On a file-URL turn an ANSWER_NOT_FOUND means we couldn't work out the task,
+            # so submitting it would just be a guaranteed wrong answer.
+            if final_answer == "ANSWER_NOT_FOUND" and data_url == current_url:
+                print("No answer for the data file URL, not submitting. Stopping task.")
+                break
+            
             submission_payload = {
                 "email": email,
                 "secret": secret,
@@ -96,12 +217,15 @@ async def run_quiz_solver_background(email: str, secret: str, initial_url: str):
             }
             
             print(f"Submitting answer to: {submit_url}") # This will now be a FULL URL
-            async with httpx.AsyncClient() as client:
-                submit_response = await client.post(
+            client = get_client()
+            submit_response = await run_phase(
+                client.post(
                     submit_url, 
                     json=submission_payload,
-                    timeout=30.0
-                )
+                    timeout=phase_timeout(deadline, SUBMIT_BUDGET)
+                ),
+                deadline, SUBMIT_BUDGET
+            )
             
             submit_response.raise_for_status() 
             result_data = submit_response.json()
@@ -114,6 +238,8 @@ async def run_quiz_solver_background(email: str, secret: str, initial_url: str):
                     print("Quiz complete! No new URL provided.")
             else:
                 print(f"Answer was WRONG. Reason: {result_data.get('reason')}")
+                # Don't replay this turn's plan/answer from the cache on a retry
+                await _evict_turn(page_context, question, data_context, current_url)
                 current_url = result_data.get("url") 
                 if not current_url:
                     print("Quiz ended on a wrong answer.")
@@ -121,6 +247,8 @@ async def run_quiz_solver_background(email: str, secret: str, initial_url: str):
         except Exception as e:
             print(f"---!! An unexpected error occurred in the agent loop !!---")
             print(f"Error: {e}")
+            # e.g. a plan with a bad submit_url -> submit 4xx. Don't cache that plan.
+            await _evict_turn(page_context, question, data_context, current_url)
             current_url = None 
             
     print("\n--- Quiz Run Finished ---")
\ No newline at end of file
